@@ -38,9 +38,8 @@ class NuScenesDataset(DatasetTemplate):
             info_path = self.root_path / info_path
             if not info_path.exists():
                 continue
-            with open(info_path, 'rb') as f:
-                infos = pickle.load(f)
-                nuscenes_infos.extend(infos)
+            infos = common_utils.load_pickle(info_path)
+            nuscenes_infos.extend(infos)
 
         self.infos.extend(nuscenes_infos)
         self.logger.info('Total samples for NuScenes dataset: %d' % (len(nuscenes_infos)))
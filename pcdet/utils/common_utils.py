@@ -11,6 +11,11 @@ import torch
 import torch.distributed as dist
 import torch.multiprocessing as mp
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 def check_numpy_to_torch(x):
     if isinstance(x, np.ndarray):
@@ -255,6 +260,33 @@ def merge_results_dist(result_part, size, tmpdir):
     return ordered_results
 
 
+PICKLE_BUFFER_SIZE = 4 << 20  # multi-GB info files, avoid the default 8 KiB buffer
+
+
+def save_pickle(obj, path):
+    """
+    Pickle obj with the highest protocol, zstd-compressed when path ends with '.zst'
+    """
+    path = str(path)
+    with open(path, 'wb', buffering=PICKLE_BUFFER_SIZE) as f:
+        if path.endswith('.zst'):
+            assert zstandard is not None, 'zstandard is required to write %s' % path
+            with zstandard.ZstdCompressor(level=3).stream_writer(f, closefd=False) as w:
+                pickle.dump(obj, w, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_pickle(path):
+    path = str(path)
+    with open(path, 'rb', buffering=PICKLE_BUFFER_SIZE) as f:
+        if path.endswith('.zst'):
+            assert zstandard is not None, 'zstandard is required to read %s' % path
+            with zstandard.ZstdDecompressor().stream_reader(f, closefd=False) as r:
+                return pickle.load(r)
+        return pickle.load(f)
+
+
 def scatter_point_inds(indices, point_inds, shape):
     ret = -1 * torch.ones(*shape, dtype=point_inds.dtype, device=point_inds.device)
     ndim = indices.shape[-1]
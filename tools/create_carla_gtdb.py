@@ -1,4 +1,5 @@
 # tools/create_carla_gtdb.py
+import argparse
 import yaml
 from pathlib import Path
 from easydict import EasyDict
@@ -6,14 +7,23 @@ from pcdet.utils import common_utils
 from pcdet.datasets.nuscenes.nuscenes_dataset import NuScenesDataset
 
 def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--zstd", action="store_true",
+                    help="Read the .pkl.zst written by create_carla_train_infos.py --zstd")
+    args = ap.parse_args()
+
     cfg_path = Path("tools/cfgs/dataset_configs/nuscenes_dataset.yaml")
-    cfg = EasyDict(yaml.safe_load(open(cfg_path, "r")))
+    # libyaml-backed loader when PyYAML was built with it
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(cfg_path, "rb") as f:
+        cfg = EasyDict(yaml.load(f, Loader=loader))
 
     cfg.VERSION = "v1.0-trainval"
     cfg.MAX_SWEEPS = 1
 
     # Use CARLA infos as "train"
-    cfg.INFO_PATH["train"] = ["nuscenes_infos_1sweeps_train_carla.pkl"]
+    suffix = ".pkl.zst" if args.zstd else ".pkl"
+    cfg.INFO_PATH["train"] = [f"nuscenes_infos_1sweeps_train_carla{suffix}"]
 
     dataset = NuScenesDataset(
         dataset_cfg=cfg,
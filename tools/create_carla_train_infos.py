@@ -1,11 +1,33 @@
 # tools/create_carla_train_infos.py
+import os
+import json
+import argparse
 from pathlib import Path
-import pickle
 from nuscenes.nuscenes import NuScenes
 from pcdet.datasets.nuscenes import nuscenes_utils
+from pcdet.utils import common_utils
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def parse_table(raw: bytes):
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+class CarlaNuScenes(NuScenes):
+    # NOTE: overrides the devkit's private table loader only to parse with orjson;
+    # re-check it against the installed nuscenes-devkit when upgrading
+    def __load_table__(self, table_name):
+        with open(os.path.join(self.table_root, f"{table_name}.json"), "rb") as f:
+            return parse_table(f.read())
+
+def list_records(root: Path):
+    with os.scandir(root) as it:
+        return sorted(Path(e.path) for e in it if e.name.startswith("record_") and e.is_dir())
 
 def build_infos_for_one_record(record_dir: Path, max_sweeps: int):
-    nusc = NuScenes(version="v1.0-nusc_like", dataroot=str(record_dir), verbose=False)
+    nusc = CarlaNuScenes(version="v1.0-nusc_like", dataroot=str(record_dir), verbose=False)
 
     # Put ALL scenes into train set (no val split for CARLA)
     train_scene_tokens = set([s["token"] for s in nusc.scene])
@@ -23,6 +45,11 @@ def build_infos_for_one_record(record_dir: Path, max_sweeps: int):
     return train_infos
 
 def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--zstd", action="store_true",
+                    help="Write a zstd-compressed .pkl.zst (needs zstandard; point INFO_PATH at it before training)")
+    args = ap.parse_args()
+
     # Global nuScenes root used by OpenPCDet
     global_root = Path("data/nuscenes/v1.0-trainval").resolve()
 
@@ -30,7 +57,7 @@ def main():
     carla_root = global_root / "carla" / "nusc_like_multi"
     assert carla_root.exists(), f"Missing {carla_root}"
 
-    record_dirs = sorted([p for p in carla_root.iterdir() if p.is_dir() and p.name.startswith("record_")])
+    record_dirs = list_records(carla_root)
     assert len(record_dirs) > 0, "No record_* folders found"
 
     max_sweeps = 1
@@ -50,9 +77,9 @@ def main():
 
         print(f"[OK] {rec.name}: {len(infos)} samples")
 
-    out_path = global_root / f"nuscenes_infos_1sweeps_train_carla.pkl"
-    with open(out_path, "wb") as f:
-        pickle.dump(all_infos, f)
+    suffix = ".pkl.zst" if args.zstd else ".pkl"
+    out_path = global_root / f"nuscenes_infos_1sweeps_train_carla{suffix}"
+    common_utils.save_pickle(all_infos, out_path)
 
     print("Saved:", out_path)
     print("Total CARLA train samples:", len(all_infos))
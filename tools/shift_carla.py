@@ -1,30 +1,131 @@
 #!/usr/bin/env python3
 import os
 import json
-import glob
 import argparse
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# ijson's pure-python backend is far slower than load_json, only stream with a C backend
+IJSON_STREAMING = ijson is not None and getattr(ijson, "backend", None) in ("yajl2_c", "yajl2_cffi")
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def shift_z_kernel(buf, point_dim, dz):
+        for i in numba.prange(buf.shape[0] // point_dim):
+            buf[i * point_dim + 2] += dz
+else:
+    shift_z_kernel = None
 
 def load_json(p):
+    if orjson is not None:
+        with open(p, "rb") as f:
+            return orjson.loads(f.read())
     with open(p, "r", encoding="utf-8") as f:
         return json.load(f)
 
 def save_json(p, obj):
+    if orjson is not None:
+        with open(p, "wb") as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+        return
     with open(p, "w", encoding="utf-8") as f:
         json.dump(obj, f, indent=2)
 
+LIDAR_PREFIXES = ("samples/lidar_top/", "sweeps/lidar_top/")
+
+def is_lidar_row(sd):
+    fn = str(sd.get("filename", "")).lower()
+    # robust: your sample_data.json has channel/modality as None
+    # ("/lidar_" in a .bin name is already covered by the "lidar" check)
+    return fn.startswith(LIDAR_PREFIXES) or (fn.endswith(".bin") and "lidar" in fn)
+
+def load_lidar_entries(p):
+    # sample_data.json is only read, so stream it and keep the lidar rows only
+    if not IJSON_STREAMING:
+        return [x for x in load_json(p) if is_lidar_row(x)]
+    with open(p, "rb") as f:
+        return [x for x in ijson.items(f, "item", use_float=True) if is_lidar_row(x)]
+
+def load_translations(sample_ann, p) -> np.ndarray:
+    # schema says every translation is a length-3 list: spot-check the head with a
+    # readable error, numpy then rejects anything ragged in the rest
+    if not sample_ann:
+        return np.zeros((0, 3), dtype=np.float64)
+    for ann in sample_ann[:1000]:
+        tr = ann.get("translation", None)
+        if not (isinstance(tr, list) and len(tr) == 3):
+            raise ValueError(f"[BAD ANNOTATION] {p}: token={ann.get('token')} translation={tr}")
+    try:
+        trs = np.array([ann["translation"] for ann in sample_ann], dtype=np.float64)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"[BAD ANNOTATION] {p}: translations are not all length-3 lists ({e})")
+    if trs.shape != (len(sample_ann), 3):
+        raise ValueError(f"[BAD ANNOTATION] {p}: translations have shape {trs.shape}, expected ({len(sample_ann)}, 3)")
+    return trs
+
 def norm_rel_path(s: str) -> str:
     # sample_data["filename"] may contain backslashes from Windows
     return s.replace("\\", "/").lstrip("/")
 
-def shift_bin_inplace(bin_path: str, point_dim: int, dz: float) -> int:
-    arr = np.fromfile(bin_path, dtype=np.float32)
-    if arr.size % point_dim != 0:
-        raise ValueError(f"[BAD BIN SHAPE] {bin_path}: size={arr.size} not divisible by point_dim={point_dim}")
-    pts = arr.reshape(-1, point_dim)
-    pts[:, 2] += dz
-    pts.astype(np.float32).tofile(bin_path)
-    return pts.shape[0]
+def list_records(root: str):
+    with os.scandir(root) as it:
+        return sorted(e.path for e in it if e.name.startswith("record_") and e.is_dir())
+
+def iter_files(root: str):
+    # recursive walk reusing the cached DirEntry type info instead of one stat per entry
+    with os.scandir(root) as it:
+        for e in it:
+            if e.is_dir(follow_symlinks=False):
+                yield from iter_files(e.path)
+            elif e.is_file():
+                yield e
+
+def build_basename_index(root: str):
+    index = {}
+    for e in iter_files(root):
+        index.setdefault(e.name, []).append(e.path)
+    return index
+
+def check_bin_size(bin_path: str, point_dim: int) -> int:
+    nbytes = os.path.getsize(bin_path)
+    if nbytes % (4 * point_dim) != 0:
+        raise ValueError(f"[BAD BIN SHAPE] {bin_path}: bytes={nbytes} not divisible by 4*point_dim={4 * point_dim}")
+    return nbytes
+
+def shift_bin_inplace(bin_path: str, point_dim: int, dz: float, use_kernel: bool = False) -> int:
+    size = check_bin_size(bin_path, point_dim) // 4
+    if size == 0:
+        return 0
+    # modify the file in place, no second full-size buffer
+    mm = np.memmap(bin_path, dtype=np.float32, mode="r+")
+    npts = size // point_dim
+    if use_kernel:
+        shift_z_kernel(mm.view(np.ndarray), point_dim, np.float32(dz))
+    else:
+        pts = mm.reshape(-1, point_dim)
+        pts[:, 2] += dz
+        del pts
+    mm.flush()
+    del mm
+    return npts
+
+def shift_bin_task(task) -> int:
+    return shift_bin_inplace(*task)
 
 def main():
     ap = argparse.ArgumentParser()
@@ -39,12 +140,14 @@ def main():
                     help="Allow shifting again even if marker exists (DANGEROUS)")
     ap.add_argument("--dry_run", action="store_true",
                     help="Print what would change, do not write files")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                    help="Number of processes used to shift lidar bins (1: serial, numba-threaded if available)")
     args = ap.parse_args()
 
     carla_root = os.path.abspath(args.carla_root)
     assert os.path.isdir(carla_root), f"Not a folder: {carla_root}"
 
-    record_dirs = sorted([p for p in glob.glob(os.path.join(carla_root, "record_*")) if os.path.isdir(p)])
+    record_dirs = list_records(carla_root)
     if not record_dirs:
         raise RuntimeError(f"No record_* folders found under {carla_root}")
 
@@ -54,112 +157,118 @@ def main():
     total_bins = 0
     total_points = 0
     total_ann = 0
+    # the threaded kernel only pays off when it has the cores to itself, i.e. no process pool
+    use_kernel = shift_z_kernel is not None and args.workers == 1
+    pool = None  # started on the first record that needs it, shared by all records
+
+    try:
+        for rec in record_dirs:
+            marker = os.path.join(rec, f".zshifted_{args.delta_z:+.3f}")
+            if os.path.exists(marker) and not args.force:
+                print(f"[SKIP] {os.path.basename(rec)} already shifted (marker exists): {marker}")
+                continue
 
-    for rec in record_dirs:
-        marker = os.path.join(rec, f".zshifted_{args.delta_z:+.3f}")
-        if os.path.exists(marker) and not args.force:
-            print(f"[SKIP] {os.path.basename(rec)} already shifted (marker exists): {marker}")
-            continue
-
-        ver = os.path.join(rec, args.version_dir)
-        if not os.path.isdir(ver):
-            print(f"[WARN] {os.path.basename(rec)} missing version dir: {ver} (skipping)")
-            continue
-
-        sample_data_p = os.path.join(ver, "sample_data.json")
-        sample_ann_p  = os.path.join(ver, "sample_annotation.json")
-
-        if not os.path.isfile(sample_data_p):
-            print(f"[WARN] Missing: {sample_data_p} (skipping record)")
-            continue
-        if not os.path.isfile(sample_ann_p):
-            print(f"[WARN] Missing: {sample_ann_p} (skipping record)")
-            continue
-
-        sample_data = load_json(sample_data_p)
-        sample_ann  = load_json(sample_ann_p)
-
-        # --- Shift LiDAR bins ---
-        def is_lidar_row(sd):
-            fn = str(sd.get("filename", "")).lower()
-            # robust: your sample_data.json has channel/modality as None
-            return (
-                fn.startswith("samples/lidar_top/") or
-                fn.startswith("sweeps/lidar_top/") or
-                ("/lidar_" in fn and fn.endswith(".bin")) or
-                ("lidar" in fn and fn.endswith(".bin"))
-            )
-
-        lidar_entries = [x for x in sample_data if is_lidar_row(x)]
-
-        if not lidar_entries:
-            print(f"[WARN] {os.path.basename(rec)}: no channel={args.lidar_channel} entries found in sample_data.json")
-        else:
-            print(f"[REC] {os.path.basename(rec)}: shifting {len(lidar_entries)} lidar frames")
-
-        rec_bins = 0
-        rec_points = 0
-        for sd in lidar_entries:
-            fn = sd.get("filename", "")
-            if not fn:
+            ver = os.path.join(rec, args.version_dir)
+            if not os.path.isdir(ver):
+                print(f"[WARN] {os.path.basename(rec)} missing version dir: {ver} (skipping)")
                 continue
-            fn = norm_rel_path(fn)
 
-            # Most exporters store paths relative to record root, e.g. "sweeps/LIDAR_TOP/xxx.bin"
-            # If yours already includes "record_xxx/...", norm_rel_path keeps it but we handle both:
-            candidate1 = os.path.join(rec, fn)
-            candidate2 = os.path.join(carla_root, fn)  # fallback if filename is rooted at carla_root
+            sample_data_p = os.path.join(ver, "sample_data.json")
+            sample_ann_p  = os.path.join(ver, "sample_annotation.json")
 
-            if os.path.isfile(candidate1):
-                bin_path = candidate1
-            elif os.path.isfile(candidate2):
-                bin_path = candidate2
+            if not os.path.isfile(sample_data_p):
+                print(f"[WARN] Missing: {sample_data_p} (skipping record)")
+                continue
+            if not os.path.isfile(sample_ann_p):
+                print(f"[WARN] Missing: {sample_ann_p} (skipping record)")
+                continue
+
+            sample_ann  = load_json(sample_ann_p)
+            # validate before any bin is touched, a failure here must not leave a half-shifted record
+            trs = load_translations(sample_ann, sample_ann_p)
+
+            # --- Shift LiDAR bins ---
+            lidar_entries = load_lidar_entries(sample_data_p)
+
+            if not lidar_entries:
+                print(f"[WARN] {os.path.basename(rec)}: no channel={args.lidar_channel} entries found in sample_data.json")
             else:
-                # last resort: try to locate by basename inside record
-                base = os.path.basename(fn)
-                hits = glob.glob(os.path.join(rec, "**", base), recursive=True)
-                if len(hits) == 1 and os.path.isfile(hits[0]):
-                    bin_path = hits[0]
+                print(f"[REC] {os.path.basename(rec)}: shifting {len(lidar_entries)} lidar frames")
+
+            bin_tasks = []
+            basename_index = None  # built on first miss, keeps the fast path free
+            for sd in lidar_entries:
+                fn = sd.get("filename", "")
+                if not fn:
+                    continue
+                fn = norm_rel_path(fn)
+
+                # Most exporters store paths relative to record root, e.g. "sweeps/LIDAR_TOP/xxx.bin"
+                # If yours already includes "record_xxx/...", norm_rel_path keeps it but we handle both:
+                candidate1 = os.path.join(rec, fn)
+                candidate2 = os.path.join(carla_root, fn)  # fallback if filename is rooted at carla_root
+
+                if os.path.isfile(candidate1):
+                    bin_path = candidate1
+                elif os.path.isfile(candidate2):
+                    bin_path = candidate2
                 else:
-                    raise FileNotFoundError(
-                        f"Could not locate lidar bin for filename='{sd.get('filename')}'\n"
-                        f"Tried:\n  {candidate1}\n  {candidate2}\n"
-                        f"and basename search hits={len(hits)}"
-                    )
+                    # last resort: try to locate by basename inside record
+                    if basename_index is None:
+                        basename_index = build_basename_index(rec)
+                    hits = basename_index.get(os.path.basename(fn), [])
+                    if len(hits) == 1:
+                        bin_path = hits[0]
+                    else:
+                        raise FileNotFoundError(
+                            f"Could not locate lidar bin for filename='{sd.get('filename')}'\n"
+                            f"Tried:\n  {candidate1}\n  {candidate2}\n"
+                            f"and basename search hits={len(hits)}"
+                        )
 
-            if args.dry_run:
-                rec_bins += 1
-                continue
+                # reject bad bins before anything is dispatched, a worker failing mid-record
+                # would leave the other queued bins shifted without a marker
+                check_bin_size(bin_path, args.point_dim)
+                bin_tasks.append((bin_path, args.point_dim, args.delta_z, use_kernel))
+
+            rec_bins = len(bin_tasks)
+            rec_points = 0
+            if not args.dry_run and bin_tasks:
+                if args.workers > 1:
+                    if pool is None:
+                        pool = ProcessPoolExecutor(max_workers=args.workers)
+                    chunksize = max(1, len(bin_tasks) // (args.workers * 4))
+                    rec_points = sum(pool.map(shift_bin_task, bin_tasks, chunksize=chunksize))
+                else:
+                    rec_points = sum(map(shift_bin_task, bin_tasks))
 
-            npts = shift_bin_inplace(bin_path, args.point_dim, args.delta_z)
-            rec_bins += 1
-            rec_points += npts
-
-        # --- Shift annotations (global z) ---
-        # This will make lidar-frame boxes also shift ~+dz after global->lidar transform (assuming no crazy roll/pitch).
-        ann_count = 0
-        for ann in sample_ann:
-            tr = ann.get("translation", None)
-            if isinstance(tr, list) and len(tr) == 3:
-                if not args.dry_run:
-                    tr[2] = float(tr[2]) + float(args.delta_z)
+            # --- Shift annotations (global z) ---
+            # This will make lidar-frame boxes also shift ~+dz after global->lidar transform (assuming no crazy roll/pitch).
+            ann_count = len(sample_ann)
+            if not args.dry_run and ann_count > 0:
+                trs[:, 2] += float(args.delta_z)
+                # orjson writes the ndarray rows directly, stdlib json needs lists
+                rows = trs if orjson is not None else trs.tolist()
+                for ann, tr in zip(sample_ann, rows):
                     ann["translation"] = tr
-                ann_count += 1
-
-        if not args.dry_run:
-            save_json(sample_ann_p, sample_ann)
-            # marker
-            with open(marker, "w", encoding="utf-8") as f:
-                f.write("shifted\n")
-
-        total_bins += rec_bins
-        total_points += rec_points
-        total_ann += ann_count
-
-        if args.dry_run:
-            print(f"  [DRY] would shift bins={rec_bins}, would shift annotations={ann_count}")
-        else:
-            print(f"  [OK] shifted bins={rec_bins}, points={rec_points}, annotations={ann_count}")
+
+            if not args.dry_run:
+                save_json(sample_ann_p, sample_ann)
+                # marker
+                with open(marker, "w", encoding="utf-8") as f:
+                    f.write("shifted\n")
+
+            total_bins += rec_bins
+            total_points += rec_points
+            total_ann += ann_count
+
+            if args.dry_run:
+                print(f"  [DRY] would shift bins={rec_bins}, would shift annotations={ann_count}")
+            else:
+                print(f"  [OK] shifted bins={rec_bins}, points={rec_points}, annotations={ann_count}")
+    finally:
+        if pool is not None:
+            pool.shutdown()
 
     print("\n[SUMMARY]")
     if args.dry_run:
@@ -1,18 +1,61 @@
 import os, json, argparse
+from functools import lru_cache
 import numpy as np
 import open3d as o3d
 import transforms3d.quaternions
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
 # --- Math Helpers ---
 def quat_wxyz_to_R(q):
     return transforms3d.quaternions.quat2mat(np.array(q, dtype=np.float64))
 
+def quat_wxyz_to_R_batch(q):
+    # Vectorized transforms3d.quaternions.quat2mat for (N,4) wxyz quaternions
+    q = np.asarray(q, dtype=np.float64).reshape(-1, 4)
+    w, x, y, z = q.T
+    Nq = np.einsum("ij,ij->i", q, q)
+    s = np.divide(2.0, Nq, out=np.zeros_like(Nq), where=Nq >= np.finfo(np.float64).eps)
+    X, Y, Z = x * s, y * s, z * s
+    wX, wY, wZ = w * X, w * Y, w * Z
+    xX, xY, xZ = x * X, x * Y, x * Z
+    yY, yZ, zZ = y * Y, y * Z, z * Z
+    R = np.empty((q.shape[0], 3, 3), dtype=np.float64)
+    R[:, 0, 0] = 1.0 - (yY + zZ); R[:, 0, 1] = xY - wZ; R[:, 0, 2] = xZ + wY
+    R[:, 1, 0] = xY + wZ; R[:, 1, 1] = 1.0 - (xX + zZ); R[:, 1, 2] = yZ - wX
+    R[:, 2, 0] = xZ - wY; R[:, 2, 1] = yZ + wX; R[:, 2, 2] = 1.0 - (xX + yY)
+    return R
+
+def make_T_batch(t, q):
+    t = np.asarray(t, dtype=np.float64).reshape(-1, 3)
+    T = np.tile(np.eye(4, dtype=np.float64), (t.shape[0], 1, 1))
+    T[:, :3, :3] = quat_wxyz_to_R_batch(q)
+    T[:, :3, 3] = t
+    return T
+
 def make_T(t, q):
     T = np.eye(4, dtype=np.float64)
     T[:3,:3] = quat_wxyz_to_R(q)
     T[:3,3] = np.array(t, dtype=np.float64)
     return T
 
+@lru_cache(maxsize=4096)
+def _make_T_cached(t, q):
+    T = make_T(list(t), list(q))
+    T.flags.writeable = False  # shared between callers
+    return T
+
+def make_T_cached(t, q):
+    return _make_T_cached(tuple(t), tuple(q))
+
 def inv_T(T):
     R = T[:3,:3]
     t = T[:3,3]
@@ -23,9 +66,39 @@ def inv_T(T):
 
 def load_table(root, version, name):
     p = os.path.join(root, version, name)
+    if orjson is not None:
+        with open(p, "rb") as f:
+            return orjson.loads(f.read())
     with open(p, "r", encoding="utf-8") as f:
         return json.load(f)
 
+def load_table_by_token(root, version, name, parsers):
+    """token -> row; with simdjson the rows are lazy proxies, so their parser is kept alive in parsers"""
+    if simdjson is None:
+        return {x["token"]: x for x in load_table(root, version, name)}
+    # a simdjson parser holds a single document, so every table needs its own
+    parser = simdjson.Parser()
+    parsers.append(parser)
+    return {x["token"]: x for x in parser.load(os.path.join(root, version, name))}
+
+# Unit box corners (bottom face 0-3, top face 4-7) and the 12 edges joining them
+BOX_CORNER_SIGNS = np.array([
+    [-1, -1, -1], [1, -1, -1], [1, 1, -1], [-1, 1, -1],
+    [-1, -1, 1], [1, -1, 1], [1, 1, 1], [-1, 1, 1],
+], dtype=np.float64)
+BOX_EDGES = np.array([
+    [0, 1], [1, 2], [2, 3], [3, 0],
+    [4, 5], [5, 6], [6, 7], [7, 4],
+    [0, 4], [1, 5], [2, 6], [3, 7],
+], dtype=np.int32)
+BOX_COLOR = (1.0, 0.0, 0.0)
+
+def hide_line_set(ls):
+    # an empty LineSet fails to bind and warns on every redraw, so collapse it to one point instead
+    ls.points = o3d.utility.Vector3dVector(np.zeros((1, 3)))
+    ls.lines = o3d.utility.Vector2iVector(np.zeros((1, 2), dtype=np.int32))
+    ls.colors = o3d.utility.Vector3dVector(np.zeros((1, 3)))
+
 # --- Visualizer Class ---
 class NuscVisualizer:
     def __init__(self, root, version, lidar_name, start_idx=0):
@@ -37,22 +110,26 @@ class NuscVisualizer:
         # Load metadata
         print(f"Loading tables from {os.path.join(root, version)}...")
         self.samples = load_table(root, version, "sample.json")
-        sample_data = load_table(root, version, "sample_data.json")
-        ego_pose = load_table(root, version, "ego_pose.json")
-        calib = load_table(root, version, "calibrated_sensor.json")
         self.anns = load_table(root, version, "sample_annotation.json")
 
-        self.sd_by_token = {x["token"]: x for x in sample_data}
-        self.ego_by_token = {x["token"]: x for x in ego_pose}
-        self.calib_by_token = {x["token"]: x for x in calib}
+        self._parsers = []
+        self.sd_by_token = load_table_by_token(root, version, "sample_data.json", self._parsers)
+        self.ego_by_token = load_table_by_token(root, version, "ego_pose.json", self._parsers)
+        self.calib_by_token = load_table_by_token(root, version, "calibrated_sensor.json", self._parsers)
+
+        self.anns_by_sample = {}
+        for a in self.anns:
+            self.anns_by_sample.setdefault(a["sample_token"], []).append(a)
 
         # State storage
         self.pcd = o3d.geometry.PointCloud()
-        self.box_geoms = []
+        self._pt_buf = np.empty(300_000 * 5, dtype=np.float32)  # reused for every frame, grown on demand
+        self.box_pool = []  # LineSets registered once, refilled every frame
+        self.boxes_shown = 0  # pool entries holding a box, the rest are hidden
         self.first_render = True
 
     def load_frame_data(self):
-        """Loads data for self.idx into self.pcd and returns new box geometries"""
+        """Loads data for self.idx into self.pcd and returns the (N,8,3) box corners"""
         # Bounds check
         if self.idx < 0: self.idx = 0
         if self.idx >= len(self.samples): self.idx = len(self.samples) - 1
@@ -64,14 +141,20 @@ class NuscVisualizer:
         ego = self.ego_by_token[sd["ego_pose_token"]]
         cs = self.calib_by_token[sd["calibrated_sensor_token"]]
 
-        T_ego_global = make_T(ego["translation"], ego["rotation"])
-        T_lidar_ego = make_T(cs["translation"], cs["rotation"])
+        # calibrated sensor poses repeat across frames, ego poses on revisits
+        T_ego_global = make_T_cached(ego["translation"], ego["rotation"])
+        T_lidar_ego = make_T_cached(cs["translation"], cs["rotation"])
         T_lidar_global = T_ego_global @ T_lidar_ego
         T_global_lidar = inv_T(T_lidar_global)
 
         # Load LIDAR
         bin_path = os.path.join(self.root, sd["filename"])
-        raw_data = np.fromfile(bin_path, dtype=np.float32)
+        nbytes = os.path.getsize(bin_path)
+        if nbytes > self._pt_buf.nbytes:
+            self._pt_buf = np.empty((nbytes + 3) // 4, dtype=np.float32)
+        with open(bin_path, "rb") as f:
+            n = f.readinto(self._pt_buf.view(np.uint8)) // 4
+        raw_data = self._pt_buf[:n]
         
         # FIX: Check if divisible by 5 (NuScenes standard) or 4 (Basic)
         if raw_data.size % 5 == 0:
@@ -80,7 +163,7 @@ class NuscVisualizer:
             pts = raw_data.reshape(-1, 4)
         else:
             print(f"Error: Point cloud size {raw_data.size} is not divisible by 4 or 5.")
-            return [], "Error loading frame"
+            return np.zeros((0, 8, 3)), "Error loading frame"
         
         xyz = pts[:, :3]
         intensity = pts[:, 3:4]
@@ -88,49 +171,59 @@ class NuscVisualizer:
         # Reset PCD data
         self.pcd.points = o3d.utility.Vector3dVector(xyz.astype(np.float64))
         if intensity.size > 0:
-            i = intensity
-            i = (i - i.min()) / (i.max() - i.min() + 1e-6)
-            colors = np.repeat(i, 3, axis=1)
+            mn = intensity.min()
+            norm = (intensity - mn) * (1.0 / (intensity.max() - mn + 1e-6))
+            # gray: broadcast view instead of an np.repeat float32 buffer; the float64
+            # (N,3) copy Open3D needs is still made once below
+            colors = np.broadcast_to(norm, (norm.shape[0], 3))
             self.pcd.colors = o3d.utility.Vector3dVector(colors.astype(np.float64))
 
         # Generate Boxes
-        new_boxes = []
-        current_anns = [a for a in self.anns if a["sample_token"] == s["token"]]
-        for a in current_anns:
-            T_box_global = make_T(a["translation"], a["rotation"])
-            T_box_lidar = T_global_lidar @ T_box_global
-            
-            w, l, h = a["size"]
-            # Open3D extent is x,y,z relative to box rotation
-            extent = np.array([l, w, h], dtype=np.float64) 
-            
-            obb = o3d.geometry.OrientedBoundingBox(
-                center=T_box_lidar[:3,3], 
-                R=T_box_lidar[:3,:3], 
-                extent=extent
-            )
-            obb.color = (1.0, 0.0, 0.0)
-            new_boxes.append(obb)
-            
-        return new_boxes, f"Frame {self.idx}"
+        current_anns = self.anns_by_sample.get(s["token"], [])
+        if not current_anns:
+            return np.zeros((0, 8, 3)), f"Frame {self.idx}"
+
+        T_box_global = make_T_batch([a["translation"] for a in current_anns],
+                                    [a["rotation"] for a in current_anns])
+        T_box_lidar = np.einsum("ij,njk->nik", T_global_lidar, T_box_global)
+
+        # sizes are w,l,h; box extent is x,y,z relative to box rotation
+        sizes = np.array([a["size"] for a in current_anns], dtype=np.float64)
+        extents = sizes[:, [1, 0, 2]]
+
+        local = 0.5 * extents[:, None, :] * BOX_CORNER_SIGNS[None]
+        corners = np.einsum("nij,nkj->nki", T_box_lidar[:, :3, :3], local) + T_box_lidar[:, None, :3, 3]
+        return corners, f"Frame {self.idx}"
 
     def update_renderer(self, vis):
-        """Clear old geometry, add new geometry"""
-        # 1. Remove old boxes
-        for b in self.box_geoms:
-            vis.remove_geometry(b, reset_bounding_box=False)
-        
-        # 2. Remove old PCD
-        vis.remove_geometry(self.pcd, reset_bounding_box=False)
+        """Refill the registered geometry in place instead of remove + add"""
+        # 1. Load new data
+        corners, title = self.load_frame_data()
+
+        # 2. Register PCD once, afterwards only push the new buffers
+        if self.first_render:
+            vis.add_geometry(self.pcd, reset_bounding_box=False)
+        else:
+            vis.update_geometry(self.pcd)
 
-        # 3. Load new data
-        new_boxes, title = self.load_frame_data()
-        self.box_geoms = new_boxes
+        # 3. Grow the box pool to the largest frame seen so far
+        while len(self.box_pool) < len(corners):
+            ls = o3d.geometry.LineSet()
+            hide_line_set(ls)
+            self.box_pool.append(ls)
+            vis.add_geometry(ls, reset_bounding_box=False)
 
-        # 4. Add new PCD and Boxes
-        vis.add_geometry(self.pcd, reset_bounding_box=False)
-        for b in self.box_geoms:
-            vis.add_geometry(b, reset_bounding_box=False)
+        # 4. Refill used boxes, hide the ones the previous frame used but this one does not
+        for k in range(len(corners)):
+            ls = self.box_pool[k]
+            ls.points = o3d.utility.Vector3dVector(corners[k])
+            ls.lines = o3d.utility.Vector2iVector(BOX_EDGES)
+            ls.paint_uniform_color(BOX_COLOR)
+            vis.update_geometry(ls)
+        for ls in self.box_pool[len(corners):self.boxes_shown]:
+            hide_line_set(ls)
+            vis.update_geometry(ls)
+        self.boxes_shown = len(corners)
 
         # 5. Handle Camera Reset (Only on first frame)
         if self.first_render: